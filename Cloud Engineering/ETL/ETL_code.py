@@ -2,22 +2,63 @@ import os
 import sys
 import json
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 import io
+import hashlib
+import inspect
 import logging
+import threading
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 
 # Add to the system path for Lambda Layers
 sys.path.append('/opt')
-os.environ['LD_LIBRARY_PATH'] = '/opt/python/numpy.libs:/opt/python/pandas.libs:/opt/python'
+os.environ['LD_LIBRARY_PATH'] = '/opt/python/numpy.libs:/opt/python/pandas.libs:/opt/python/pyarrow:/opt/python'
 
 # Setup logger
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Initialize S3 client
-s3 = boto3.client('s3')
+# Timestamp layout of the raw created_at/updated_at columns (customers and orders)
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Number of raw objects fetched side by side in lambda_handler
+READ_WORKERS = 4
+
+# Cleaned frames are cached as Parquet, keyed by the ETag of the raw object they came from and
+# a hash of the cleaner's source, so a deploy that changes a cleaner re-cleans its input
+MANIFEST_KEY = "processed_data/manifest.json"
+CLEANED_PREFIX = "processed_data/cleaned/"
+
+# Columns each lookup table contributes to the joined output (join keys first)
+CUSTOMER_COLUMNS = ['customer_id', 'gender', 'dob']
+LOCATION_COLUMNS = ['customer_id', 'LOCATION_NUMBER', 'LOCATION_TYPE', 'latitude', 'longitude']
+VENDOR_COLUMNS = ['vendor_id', 'latitude_vendor', 'longtitude_vendor', 'vendor_category_en', 'delivery_charge', 'vendor_tag_name']
+
+# Orders are joined and written in this many row partitions
+MERGE_PARTITIONS = 8
+
+# Number of objects the joined output is streamed to at the same time in lambda_handler
+OUTPUT_STREAMS = 2
+
+# Multipart settings: objects are moved in 8 MB parts, several parts at a time
+transfer_config = TransferConfig(multipart_chunksize=8 * 1024 * 1024, max_concurrency=4)
+
+# The streamed output is produced while it uploads, so more of its parts are kept in flight
+stream_config = TransferConfig(multipart_chunksize=8 * 1024 * 1024, max_concurrency=8)
+
+# Initialize S3 client with enough pooled connections for every concurrent part of the busier
+# phase: the parallel reads (and cleaned-frame uploads), or the concurrent output streams
+s3 = boto3.client('s3', config=Config(max_pool_connections=max(
+    READ_WORKERS * transfer_config.max_request_concurrency,
+    OUTPUT_STREAMS * stream_config.max_request_concurrency
+)))
 
 def lambda_handler(event, context):
     bucket_name = "ce-raw-datasets"
@@ -25,26 +66,44 @@ def lambda_handler(event, context):
     location_key = "train_locations.csv"
     order_key = "orders.csv"
     vendor_key = "vendors.csv"
+    # Loaded into the order_clean_join_all RDS table, which reads the CSV
     output_key = "processed_data/order_clean_join_all.csv"
+    restaurants_key = "processed_data/order_restaurants.parquet"
 
     try:
         logger.info("Starting Lambda function execution...")
         logger.info(f"NumPy Version: {np.__version__}")
         logger.info(f"Pandas Version: {pd.__version__}")
 
-        customers = read_csv_from_s3(bucket_name, customer_key)
-        locations = read_csv_from_s3(bucket_name, location_key)
-        orders = read_csv_from_s3(bucket_name, order_key)
-        vendors = read_csv_from_s3(bucket_name, vendor_key)
+        # Raw inputs are read all four at the same time since the reads are network-bound.
+        # Inputs whose ETag is unchanged since the last run skip cleaning entirely.
+        manifest = read_manifest(bucket_name)
+        cleaners = {
+            customer_key: clean_customers,
+            location_key: clean_locations,
+            order_key: clean_orders,
+            vendor_key: clean_vendors
+        }
+        with ThreadPoolExecutor(max_workers=READ_WORKERS) as executor:
+            results = list(executor.map(
+                lambda item: load_cleaned(bucket_name, item[0], item[1], manifest.get(item[0])),
+                cleaners.items()
+            ))
 
-        cleaned_customers = clean_customers(customers)
-        cleaned_locations = clean_locations(locations)
-        cleaned_orders = clean_orders(orders)
-        cleaned_vendors = clean_vendors(vendors)
+        updated = {key: entry for key, (_, entry) in zip(cleaners, results) if entry is not None}
+        if updated:
+            manifest.update(updated)
+            s3.put_object(Bucket=bucket_name, Key=MANIFEST_KEY, Body=json.dumps(manifest))
 
-        final_data = merge_datasets(cleaned_customers, cleaned_locations, cleaned_orders, cleaned_vendors)
+        cleaned_customers, cleaned_locations, cleaned_orders, cleaned_vendors = (df for df, _ in results)
 
-        upload_to_s3(final_data, bucket_name, output_key)
+        # Each joined partition is written while the previous ones are uploading. Restaurant
+        # orders also go to their own Parquet object, which is all the recommender webapp reads.
+        with S3Stream(bucket_name, output_key) as stream, \
+                S3Stream(bucket_name, restaurants_key) as restaurants:
+            for chunk in merge_datasets(cleaned_customers, cleaned_locations, cleaned_orders, cleaned_vendors):
+                stream.write(chunk)
+                restaurants.write(chunk[chunk['vendor_category_en'].eq('Restaurants').fillna(False)])
 
         logger.info(f"Data processing complete. File saved to {output_key}")
 
@@ -60,12 +119,16 @@ def lambda_handler(event, context):
             "message": str(e)
         }
 
-def read_csv_from_s3(bucket, key):
+def read_from_s3(bucket, key):
     try:
         logger.info(f"Reading {key} from bucket {bucket}")
-        response = s3.get_object(Bucket=bucket, Key=key)
-        content = response['Body'].read()
-        return pd.read_csv(io.BytesIO(content))
+        buffer = io.BytesIO()
+        s3.download_fileobj(bucket, key, buffer, Config=transfer_config)
+        buffer.seek(0)
+        # Arrow-backed dtypes keep strings in contiguous buffers and route .str ops to Arrow kernels
+        if key.endswith('.parquet'):
+            return pd.read_parquet(buffer, engine='pyarrow', dtype_backend='pyarrow')
+        return pd.read_csv(buffer, engine='pyarrow', dtype_backend='pyarrow')
     except Exception as e:
         logger.error(f"Error reading {key} from {bucket}: {str(e)}")
         raise
@@ -73,26 +136,165 @@ def read_csv_from_s3(bucket, key):
 def upload_to_s3(df, bucket, key):
     try:
         logger.info(f"Uploading data to {key} in bucket {bucket}")
-        csv_buffer = io.StringIO()
-        df.to_csv(csv_buffer, index=False)
-        s3.put_object(Bucket=bucket, Key=key, Body=csv_buffer.getvalue())
+        # Serialize straight to bytes and send it as a concurrent multipart upload
+        buffer = io.BytesIO()
+        if key.endswith('.parquet'):
+            df.to_parquet(buffer, engine='pyarrow', compression='zstd', index=False)
+        else:
+            df.to_csv(buffer, index=False)
+        buffer.seek(0)
+        s3.upload_fileobj(buffer, bucket, key, Config=transfer_config)
         logger.info(f"Data successfully uploaded to {key}")
     except Exception as e:
         logger.error(f"Error uploading to {key}: {str(e)}")
         raise
 
+class _PipeReader:
+    """Read end of an upload pipe that fails instead of reporting EOF once aborted."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.aborted = False
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        if self.aborted:
+            raise IOError("Upload stream aborted")
+        return data
+
+    def close(self):
+        self.fileobj.close()
+
+class S3Stream:
+    """
+    Writes DataFrame chunks to a single object in S3 without building the file in memory.
+    Chunks go into an OS pipe that a background upload_fileobj reads from, so serialization
+    overlaps the multipart upload. A .parquet key gets one row group per chunk, each cast to
+    the schema of the first; any other key gets CSV with the header written once.
+    """
+
+    def __init__(self, bucket, key):
+        self.bucket = bucket
+        self.key = key
+        self.writer = None
+        self.csv_started = False
+        self.error = None
+        read_fd, write_fd = os.pipe()
+        self.sink = os.fdopen(write_fd, 'wb')
+        self.source = _PipeReader(os.fdopen(read_fd, 'rb'))
+        self.thread = threading.Thread(target=self._upload, daemon=True)
+        self.thread.start()
+
+    def _upload(self):
+        try:
+            logger.info(f"Streaming data to {self.key} in bucket {self.bucket}")
+            s3.upload_fileobj(self.source, self.bucket, self.key, Config=stream_config)
+        except Exception as e:
+            if not self.source.aborted:
+                logger.error(f"Error uploading to {self.key}: {str(e)}")
+                self.error = e
+        finally:
+            # Unblocks the writing side with BrokenPipeError if the upload stopped early
+            self.source.close()
+
+    def write(self, df):
+        if not self.key.endswith('.parquet'):
+            df.to_csv(self.sink, header=not self.csv_started, index=False)
+            self.csv_started = True
+            return
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.sink, table.schema, compression='zstd')
+        else:
+            table = table.cast(self.writer.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.sink.close()
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+        logger.info(f"Data successfully uploaded to {self.key}")
+
+    def abort(self):
+        # Fail the upload rather than let it complete with a truncated file
+        self.source.aborted = True
+        for f in (self.writer, self.sink):
+            try:
+                if f is not None:
+                    f.close()
+            except Exception:
+                pass  # the pipe is already broken if the upload stopped first
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            try:
+                return self.close()
+            except Exception as e:
+                exc_value = e
+        self.abort()
+        # A broken pipe only says the upload stopped first, so report why it did
+        if isinstance(exc_value, BrokenPipeError) and self.error is not None:
+            raise self.error from exc_value
+        if exc_type is None:
+            raise exc_value
+
+def read_manifest(bucket):
+    """Returns the {source_key: [etag, cleaner_hash, cleaned_key]} cache manifest, empty if none was written yet."""
+    try:
+        response = s3.get_object(Bucket=bucket, Key=MANIFEST_KEY)
+        return json.loads(response['Body'].read())
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('404', 'NoSuchKey', 'NotFound'):
+            raise
+        return {}
+
+def load_cleaned(bucket, key, cleaner, cached):
+    """
+    Returns (cleaned frame, new manifest entry) for a raw object.
+    The entry is None when the cached Parquet was still valid and was read back instead, or when
+    the object changed while it was being read, so the ETag cannot vouch for the frame.
+    """
+    etag = s3.head_object(Bucket=bucket, Key=key)['ETag']
+    version = cleaner_hash(cleaner)
+    # Entries written before the cleaner hash was recorded have two items and never match
+    if cached is not None and cached[:2] == [etag, version]:
+        logger.info(f"{key} unchanged since last run, using {cached[-1]}")
+        return read_from_s3(bucket, cached[-1]), None
+
+    # Cleaned straight from the CSV that was just downloaded
+    df = cleaner(read_from_s3(bucket, key))
+    if s3.head_object(Bucket=bucket, Key=key)['ETag'] != etag:
+        logger.warning(f"{key} changed while it was read, not caching it")
+        return df, None
+    cleaned_key = CLEANED_PREFIX + key.rsplit('.', 1)[0] + '.parquet'
+    upload_to_s3(df, bucket, cleaned_key)
+    return df, [etag, version, cleaned_key]
+
+def cleaner_hash(cleaner):
+    """MD5 of a cleaning function's source, recorded next to the ETag of each cached frame."""
+    return hashlib.md5(inspect.getsource(cleaner).encode()).hexdigest()
+
 def clean_customers(df):
     logger.info("Cleaning customers dataset")
     try:
-        df['created_at'] = pd.to_datetime(df['created_at'])
-        df['updated_at'] = pd.to_datetime(df['updated_at'])
-        df = df.loc[df.groupby('akeed_customer_id')['updated_at'].idxmax()].reset_index(drop=True)
+        df['created_at'] = pd.to_datetime(df['created_at'], format=TIMESTAMP_FORMAT)
+        df['updated_at'] = pd.to_datetime(df['updated_at'], format=TIMESTAMP_FORMAT)
+        # Keep each customer's most recent record (first one on ties, as idxmax did)
+        df = (df.sort_values('updated_at', ascending=False, kind='stable', na_position='last')
+                .drop_duplicates('akeed_customer_id', keep='first')
+                .reset_index(drop=True))
         df.drop(['created_at', 'updated_at', 'status', 'verified', 'language'], axis=1, inplace=True, errors='ignore')
-        df['gender'] = df['gender'].str.strip().str.title().fillna('Unknown')
-        df.loc[~df['gender'].isin(['Male', 'Female']), 'gender'] = 'Unknown'
-        df['dob'] = pd.to_numeric(df['dob'], errors='coerce')
-        df.loc[df['dob'] > 2020, 'dob'] = np.nan
-        df.loc[df['dob'] < 1945, 'dob'] = np.nan
+        gender = df['gender'].str.strip().str.title()
+        df['gender'] = gender.where(gender.isin(['Male', 'Female']), 'Unknown')
+        dob = pd.to_numeric(df['dob'], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+        df['dob'] = np.where((dob > 2020) | (dob < 1945), np.nan, dob)
         df = df.rename(columns={'akeed_customer_id': 'customer_id'})
         return df
     except Exception as e:
@@ -113,13 +315,14 @@ def clean_locations(df):
 def clean_orders(df):
     logger.info("Cleaning orders dataset")
     try:
-        df['created_at'] = pd.to_datetime(df['created_at'], errors='coerce')
-        df['promo_code'] = df['promo_code'].notna().astype(int)
+        df['created_at'] = pd.to_datetime(df['created_at'], format=TIMESTAMP_FORMAT, errors='coerce', cache=True)
+        df['promo_code'] = df['promo_code'].notna().astype('int8')
         df['promo_code_discount_percentage'] = pd.to_numeric(df['promo_code_discount_percentage'], errors='coerce').fillna(0)
         df['item_count'] = pd.to_numeric(df['item_count'], errors='coerce')
-        df['item_count'] = df.groupby('customer_id')['item_count'].transform(lambda x: x.fillna(x.median()))
+        customer_medians = df.groupby('customer_id')['item_count'].median()
+        df['item_count'] = df['item_count'].fillna(df['customer_id'].map(customer_medians)).astype('float32')
         df['is_favorite'] = df['is_favorite'].fillna("No")
-        df['vendor_rating'] = pd.to_numeric(df['vendor_rating'], errors='coerce').fillna(0)
+        df['vendor_rating'] = pd.to_numeric(df['vendor_rating'], errors='coerce').fillna(0).astype('float32')
         df = df.drop('delivery_time', axis=1, errors='ignore')
         df['LOCATION_TYPE'] = df['LOCATION_TYPE'].fillna('Other')
         return df
@@ -130,30 +333,38 @@ def clean_orders(df):
 def clean_vendors(df):
     logger.info("Cleaning vendors dataset")
     try:
-        vendor_cols = ['id', 'latitude', 'longitude', 'vendor_category_en', 'delivery_charge', 'vendor_tag_name']
-        df = df[vendor_cols]
-        df = df.rename(columns={
-            'latitude': 'latitude_vendor',
-            'longitude': 'longtitude_vendor',
-            'id': 'vendor_id'
+        # Project, rename and downcast in one step rather than select-then-rename copies
+        df = pd.DataFrame({
+            'vendor_id': df['id'],
+            'latitude_vendor': df['latitude'].astype('float32'),
+            'longtitude_vendor': df['longitude'].astype('float32'),
+            'vendor_category_en': df['vendor_category_en'],
+            'delivery_charge': df['delivery_charge'].astype('float32'),
+            'vendor_tag_name': df['vendor_tag_name']
         })
         return df
     except Exception as e:
         logger.error(f"Error cleaning vendors dataset: {str(e)}")
         raise
 
-def merge_datasets(customers, locations, orders, vendors):
+def merge_datasets(customers, locations, orders, vendors, partitions=MERGE_PARTITIONS):
+    """Yields the joined orders in consecutive row ranges, so they come out in order."""
     logger.info("Merging datasets")
     try:
-        df_order_cust = pd.merge(orders, customers, on='customer_id', how='left')
+        # Project each lookup table to the columns it contributes, then index it once
+        # so each join probes an existing index and only copies what is kept
+        customers_idx = customers[CUSTOMER_COLUMNS].set_index('customer_id')
         df_loc = locations.rename(columns={'location_number': "LOCATION_NUMBER"})
-        df_order_full = pd.merge(df_order_cust, df_loc, on=['customer_id', 'LOCATION_NUMBER'], how='left')
-
-        vendor_cols = ['vendor_id', 'latitude_vendor', 'longtitude_vendor', 'vendor_category_en', 'delivery_charge', 'vendor_tag_name']
-        vendor_useful = vendors[vendor_cols]
-        df_order_full = pd.merge(df_order_full, vendor_useful, on='vendor_id', how='left')
+        locations_idx = df_loc[LOCATION_COLUMNS].set_index(['customer_id', 'LOCATION_NUMBER'])
+        vendors_idx = vendors[VENDOR_COLUMNS].set_index('vendor_id')
 
-        return df_order_full
+        # Only one partition's joined rows are materialized at a time
+        bounds = np.linspace(0, len(orders), partitions + 1).astype(int)
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            yield (orders.iloc[start:stop]
+                   .join(customers_idx, on='customer_id', how='left')
+                   .join(locations_idx, on=['customer_id', 'LOCATION_NUMBER'], how='left', lsuffix='_x', rsuffix='_y')
+                   .join(vendors_idx, on='vendor_id', how='left'))
     except Exception as e:
         logger.error(f"Error merging datasets: {str(e)}")
         raise
@@ -0,0 +1,201 @@
+import unittest
+import hashlib
+import io
+import json
+import os
+import sys
+import threading
+import pandas as pd
+from unittest.mock import patch
+from botocore.exceptions import ClientError
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import ETL_code
+
+BUCKET = "ce-raw-datasets"
+
+
+class FakeS3:
+    """In-memory stand-in for the S3 client; ETags are the MD5 of the stored bytes."""
+
+    def __init__(self):
+        self.store = {}
+        self.downloads = []
+        self.aborted = []
+        self.on_download = None
+
+    def _get(self, key):
+        if key not in self.store:
+            raise ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}}, 'HeadObject')
+        return self.store[key]
+
+    def _etag(self, key):
+        return '"%s"' % hashlib.md5(self._get(key)).hexdigest()
+
+    def head_object(self, Bucket, Key):
+        return {'ETag': self._etag(Key), 'ContentLength': len(self._get(Key))}
+
+    def get_object(self, Bucket, Key):
+        return {'Body': io.BytesIO(self._get(Key)), 'ETag': self._etag(Key)}
+
+    def download_fileobj(self, Bucket, Key, Fileobj, Config=None):
+        self.downloads.append(Key)
+        Fileobj.write(self._get(Key))
+        if self.on_download is not None:
+            self.on_download(Key)
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, Config=None):
+        # Parts are read until EOF and only then stored, as a multipart upload completes;
+        # a failed read aborts it and leaves no object behind
+        parts = []
+        try:
+            while part := Fileobj.read(8 * 1024 * 1024):
+                parts.append(part)
+        except Exception:
+            self.aborted.append(Key)
+            raise
+        self.store[Key] = b''.join(parts)
+
+    def put_object(self, Bucket, Key, Body):
+        self.store[Key] = Body.encode() if isinstance(Body, str) else Body
+
+
+def raw_inputs(gender="male"):
+    customers = pd.DataFrame({
+        'akeed_customer_id': ['C1', 'C2'], 'gender': [gender, 'Female'], 'dob': [1990.0, 1985.0],
+        'status': 1, 'verified': 1, 'language': 'EN',
+        'created_at': '2019-01-01 10:00:00', 'updated_at': '2019-01-02 10:00:00'
+    })
+    locations = pd.DataFrame({
+        'customer_id': ['C1', 'C2'], 'location_number': [0, 0], 'location_type': ['Home', None],
+        'latitude': [1.0, 2.0], 'longitude': [1.5, 2.5]
+    })
+    orders = pd.DataFrame({
+        'akeed_order_id': [1.0, 2.0, 3.0], 'customer_id': ['C1', 'C1', 'C2'],
+        'item_count': [1.0, None, 2.0], 'grand_total': [10.0, 12.5, 7.0],
+        'promo_code': [None, 'SAVE10', None], 'promo_code_discount_percentage': [None, 10.0, None],
+        'is_favorite': [None, 'Yes', 'No'], 'vendor_rating': [None, 4.0, 5.0], 'delivery_time': None,
+        'vendor_id': [100, 101, 100], 'created_at': '2019-08-01 12:00:00',
+        'LOCATION_NUMBER': [0, 0, 0], 'LOCATION_TYPE': ['Home', None, 'Work']
+    })
+    vendors = pd.DataFrame({
+        'id': [100, 101], 'latitude': [0.1, 0.2], 'longitude': [0.3, 0.4],
+        'vendor_category_en': ['Restaurants', 'Sweets & Bakes'], 'delivery_charge': [0.0, 0.7],
+        'vendor_tag_name': ['Pizza', 'Coffee']
+    })
+    return {'train_customers.csv': customers, 'train_locations.csv': locations,
+            'orders.csv': orders, 'vendors.csv': vendors}
+
+
+class TestCleanedCache(unittest.TestCase):
+    def setUp(self):
+        self.s3 = FakeS3()
+        self.put_raw(raw_inputs())
+        patcher = patch.object(ETL_code, 's3', self.s3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def put_raw(self, frames):
+        for key, df in frames.items():
+            self.s3.store[key] = df.to_csv(index=False).encode()
+
+    def manifest(self):
+        return json.loads(self.s3.store[ETL_code.MANIFEST_KEY])
+
+    def output_genders(self):
+        df = pd.read_csv(io.BytesIO(self.s3.store["processed_data/order_clean_join_all.csv"]))
+        return dict(zip(df['customer_id'], df['gender']))
+
+    def test_first_run(self):
+        # Test every source is cleaned and recorded under its current ETag
+        self.assertEqual(ETL_code.lambda_handler({}, None)["statusCode"], 200)
+
+        manifest = self.manifest()
+        for key in raw_inputs():
+            self.assertEqual(manifest[key][0], self.s3.head_object(Bucket=BUCKET, Key=key)['ETag'])
+            self.assertIn(manifest[key][2], self.s3.store)
+        self.assertEqual(manifest['train_customers.csv'][1], ETL_code.cleaner_hash(ETL_code.clean_customers))
+        self.assertEqual(self.output_genders(), {'C1': 'Male', 'C2': 'Female'})
+        csv = pd.read_csv(io.BytesIO(self.s3.store["processed_data/order_clean_join_all.csv"]))
+        self.assertEqual(csv['akeed_order_id'].tolist(), [1.0, 2.0, 3.0])
+
+    def test_partial_failure_then_source_changed(self):
+        # Test a failed run leaves nothing that hides a later change to the CSV
+        with patch.object(ETL_code, 'clean_orders', side_effect=ValueError("bad orders")):
+            self.assertEqual(ETL_code.lambda_handler({}, None)["statusCode"], 500)
+        self.assertNotIn(ETL_code.MANIFEST_KEY, self.s3.store)
+
+        self.put_raw({'train_customers.csv': raw_inputs(gender="female")['train_customers.csv']})
+        self.assertEqual(ETL_code.lambda_handler({}, None)["statusCode"], 200)
+
+        self.assertEqual(self.output_genders(), {'C1': 'Female', 'C2': 'Female'})
+        self.assertEqual(self.manifest()['train_customers.csv'][0],
+                         self.s3.head_object(Bucket=BUCKET, Key='train_customers.csv')['ETag'])
+
+    def test_source_changed(self):
+        # Test only the changed source is read again, and the others come from the cache
+        ETL_code.lambda_handler({}, None)
+        self.put_raw({'train_customers.csv': raw_inputs(gender="female")['train_customers.csv']})
+        self.s3.downloads.clear()
+
+        self.assertEqual(ETL_code.lambda_handler({}, None)["statusCode"], 200)
+
+        self.assertEqual(self.output_genders(), {'C1': 'Female', 'C2': 'Female'})
+        self.assertIn('train_customers.csv', self.s3.downloads)
+        for key in ['train_locations.csv', 'orders.csv', 'vendors.csv']:
+            self.assertNotIn(key, self.s3.downloads)
+
+    def test_cleaner_changed(self):
+        # Test a changed cleaner re-cleans its source even though the ETag is the same
+        ETL_code.lambda_handler({}, None)
+        self.s3.downloads.clear()
+        original = ETL_code.clean_customers
+
+        def clean_customers(df):
+            df = original(df)
+            df['gender'] = df['gender'].str.lower()
+            return df
+
+        with patch.object(ETL_code, 'clean_customers', clean_customers):
+            self.assertEqual(ETL_code.lambda_handler({}, None)["statusCode"], 200)
+
+        self.assertEqual(self.output_genders(), {'C1': 'male', 'C2': 'female'})
+        self.assertIn('train_customers.csv', self.s3.downloads)
+        self.assertNotIn('orders.csv', self.s3.downloads)
+        self.assertEqual(self.manifest()['train_customers.csv'][1], ETL_code.cleaner_hash(clean_customers))
+
+    def test_merge_fails_mid_stream(self):
+        # Test a join that fails after the first partition aborts every output upload, leaves no
+        # object behind and leaves no upload thread running
+        outputs = ["processed_data/order_clean_join_all.csv", "processed_data/order_restaurants.parquet"]
+        merge = ETL_code.merge_datasets
+
+        def failing_merge(*frames):
+            partitions = merge(*frames, partitions=2)
+            yield next(partitions)
+            raise ValueError("bad partition")
+
+        threads = set(threading.enumerate())
+        with patch.object(ETL_code, 'merge_datasets', failing_merge):
+            result = ETL_code.lambda_handler({}, None)
+
+        self.assertEqual(result, {"statusCode": 500, "message": "bad partition"})
+        self.assertCountEqual(self.s3.aborted, outputs)
+        for key in outputs:
+            self.assertNotIn(key, self.s3.store)
+        self.assertEqual(set(threading.enumerate()), threads)
+
+    def test_source_changed_while_read(self):
+        # Test a frame is not cached under an ETag it may not have come from
+        def overwrite(key):
+            if key == 'train_customers.csv':
+                self.s3.on_download = None
+                self.put_raw({key: raw_inputs(gender="female")[key]})
+        self.s3.on_download = overwrite
+
+        df, entry = ETL_code.load_cleaned(BUCKET, 'train_customers.csv', ETL_code.clean_customers, None)
+
+        self.assertIsNone(entry)
+        self.assertEqual(df['gender'].tolist(), ['Male', 'Female'])
+
+if __name__ == '__main__':
+    unittest.main()
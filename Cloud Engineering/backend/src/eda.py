@@ -1,6 +1,7 @@
 import matplotlib.pyplot as plt
 import seaborn as sns
 import pandas as pd
+import numpy as np
 import boto3
 import logging
 import os
@@ -67,7 +68,14 @@ def perform_eda(df, bucket_name, s3_prefix, aws_region):
 
     # 1. Correlation heatmap
     logger.info("Generating correlation heatmap")
-    corr = df.select_dtypes(include='number').corr()
+    # All-null columns have no pairs to correlate. Sparse columns use pairwise-complete rows,
+    # as DataFrame.corr does; one corrcoef pass is kept for the common case of no gaps.
+    num = df.select_dtypes(include='number').dropna(axis=1, how='all')
+    if num.notna().all().all():
+        values = np.atleast_2d(np.corrcoef(num.to_numpy(dtype='float64'), rowvar=False))
+    else:
+        values = num.corr().to_numpy()
+    corr = pd.DataFrame(values.astype('float32'), index=num.columns, columns=num.columns)
     fig1, ax1 = plt.subplots(figsize=(10, 8))
     sns.heatmap(corr, annot=True, fmt='.2f', cmap='coolwarm', square=True, ax=ax1)
     ax1.set_title('Correlation Matrix')
@@ -77,9 +85,9 @@ def perform_eda(df, bucket_name, s3_prefix, aws_region):
     # 2. Box plot: total spend per customer
     if 'customer_id' in df.columns and 'grand_total' in df.columns:
         logger.info("Generating total spend per customer box plot")
-        spend_per_customer = df.groupby('customer_id')['grand_total'].sum().reset_index()
+        spend_per_customer = df.groupby('customer_id', sort=False)['grand_total'].sum().to_numpy()
         fig2, ax2 = plt.subplots(figsize=(12, 6))
-        sns.boxplot(x=spend_per_customer['grand_total'], ax=ax2)
+        sns.boxplot(x=spend_per_customer, ax=ax2)
         ax2.set_title('Total Spend per Customer')
         ax2.set_xlabel('Total Spend')
         upload_plot_to_s3(fig2, 'box_total_spend_per_customer.png')
@@ -90,7 +98,7 @@ def perform_eda(df, bucket_name, s3_prefix, aws_region):
     # 3. Box plot: order count per customer
     if 'customer_id' in df.columns:
         logger.info("Generating order counts per customer box plot")
-        order_counts = df['customer_id'].value_counts().reset_index(drop=True)
+        order_counts = df.groupby('customer_id', sort=False).size().to_numpy()
         fig3, ax3 = plt.subplots(figsize=(12, 6))
         sns.boxplot(x=order_counts, ax=ax3)
         ax3.set_title('Box Plot of Order Counts per Customer')
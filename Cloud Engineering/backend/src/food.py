@@ -1,9 +1,10 @@
 import logging
+import numpy as np
 import pandas as pd
 import yaml
 from sklearn.cluster import KMeans
 from sklearn.preprocessing import StandardScaler
-from sklearn.feature_extraction.text import TfidfTransformer
+from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
 import os
 
 log_dir = "log"
@@ -29,6 +30,10 @@ if not logger.handlers:
 
 logger.info("Food clustering module initialized")
 
+def _split_tags(tags):
+    """Splits a comma-separated vendor_tag_name value into its tags."""
+    return [tag for tag in tags.split(',') if tag]
+
 class FOOD:
     def __init__(self, df, config_path='config.yaml'):
         """Initializes the FOOD class with config and in-memory data."""
@@ -48,11 +53,18 @@ class FOOD:
             raise
 
     def preprocess(self):
-        """Expands vendor_tag_name into dummy columns and selects predefined columns."""
+        """Expands vendor_tag_name into sparse dummy columns and selects predefined columns."""
         try:
-            temp = self.df['vendor_tag_name'].str.get_dummies(sep=',')
-            df = pd.concat([self.df.drop(columns=['vendor_tag_name']), temp], axis=1)
-            self.food_df = df[self.columns].copy()
+            vectorizer = CountVectorizer(tokenizer=_split_tags, token_pattern=None, lowercase=False, binary=True)
+            tag_matrix = vectorizer.fit_transform(self.df['vendor_tag_name'].fillna(''))
+            vocabulary = vectorizer.vocabulary_
+            tag_cols = [col for col in dict.fromkeys(self.columns) if col in vocabulary]
+            other_cols = [col for col in dict.fromkeys(self.columns) if col not in vocabulary]
+            # Most tags are absent from any given order, so keep them as a CSR matrix
+            self.tag_names = tag_cols
+            self.tag_matrix = tag_matrix[:, [vocabulary[col] for col in tag_cols]]
+            tags = pd.DataFrame.sparse.from_spmatrix(self.tag_matrix, index=self.df.index, columns=tag_cols)
+            self.food_df = pd.concat([self.df[other_cols], tags], axis=1)[self.columns]
             logger.info("Vendor tag data expanded and filtered. Final shape: %s", self.food_df.shape)
         except Exception as error:
             logger.error("Error in preprocessing data: %s", error)
@@ -62,18 +74,18 @@ class FOOD:
         """Aggregates cuisine data based on the food mapping."""
         try:
             columns_to_keep = set(sum(self.food_mapping.values(), []))
-            available_cols = [col for col in self.food_df.columns if col in columns_to_keep]
-            missing_cols = list(columns_to_keep - set(available_cols))
+            tag_index = {tag: i for i, tag in enumerate(self.tag_names)}
+            missing_cols = list(columns_to_keep - set(tag_index))
             if missing_cols:
                 logger.warning("Missing cuisine tag columns: %s", missing_cols)
 
-            filtered_df = self.food_df[['customer_id'] + available_cols]
-            agg = pd.DataFrame()
-            agg['customer_id'] = filtered_df['customer_id']
+            # 0/1 (tags x categories) mapping, so every category total comes from one sparse product
+            mapping = np.zeros((len(self.tag_names), len(self.food_mapping)), dtype=self.tag_matrix.dtype)
+            for j, tags in enumerate(self.food_mapping.values()):
+                mapping[[tag_index[tag] for tag in tags if tag in tag_index], j] = 1
 
-            for category, tags in self.food_mapping.items():
-                valid_tags = [tag for tag in tags if tag in filtered_df.columns]
-                agg[category] = filtered_df[valid_tags].sum(axis=1) if valid_tags else 0
+            agg = pd.DataFrame(self.tag_matrix @ mapping, columns=list(self.food_mapping), index=self.food_df.index)
+            agg.insert(0, 'customer_id', self.food_df['customer_id'])
 
             self.aggregated_df = agg
             logger.info("Cuisine aggregation completed. Shape: %s", agg.shape)
@@ -87,10 +99,11 @@ class FOOD:
             tfidf_transformer = TfidfTransformer()
             numerical_cols = [col for col in self.aggregated_df.columns if col != 'customer_id']
             tfidf_scaled = tfidf_transformer.fit_transform(self.aggregated_df[numerical_cols])
-            tfidf_scaled_dense = pd.DataFrame(tfidf_scaled.toarray(), columns=numerical_cols)
 
+            # KMeans takes the sparse TF-IDF matrix directly, no dense copy needed; the configured
+            # seed keeps cluster ids in line with the cluster_mapping
             kmeans = KMeans(n_clusters=self.n_clusters, random_state=self.random_state)
-            cluster_labels = kmeans.fit_predict(tfidf_scaled_dense)
+            cluster_labels = kmeans.fit_predict(tfidf_scaled)
 
             self.aggregated_df['food_cluster'] = cluster_labels
             self.aggregated_df['Segment'] = self.aggregated_df['food_cluster'].map(self.cluster_mapping)
@@ -7,7 +7,11 @@ based on customer order history using collaborative filtering and upload them to
 import logging
 import os
 import pickle
+import sys
 import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from io import StringIO
+from itertools import repeat
 import pandas as pd
 import yaml
 import boto3
@@ -39,6 +43,71 @@ if not logger.handlers:
 
 logger.info("Recommender module initialized")
 
+# Models trained and uploaded by Recommender.upload_models_to_s3
+MODEL_TYPES = ["svd", "nmf", "svdpp", "item_knn"]
+
+def _make_model(model_type, model_params):
+    """
+    Builds a recommendation model using parameters from config.
+
+    Args:
+        model_type (str): One of ['svd', 'nmf', 'svdpp', 'user_knn', 'item_knn']
+        model_params (dict): The config "models" section
+
+    Returns:
+        A Surprise model instance
+    """
+    try:
+        params = model_params.get(model_type, {})
+        if model_type == 'svd':
+            return SVD(**params)
+        if model_type == 'nmf':
+            return NMF(**params)
+        if model_type == 'svdpp':
+            return SVDpp(**params)
+        if model_type in ['user_knn', 'item_knn']:
+            return KNNBasic(sim_options=params.get("sim_options", {}))
+
+        raise ValueError(f"Unknown model type: {model_type}")
+    except Exception as error:
+        logger.error("Failed to build model: %s", error)
+        raise
+
+def _train_and_pickle(model_type, model_params, trainset_bytes):
+    """
+    Trains one model in a worker process.
+
+    Args:
+        model_type (str): Model to build, see _make_model
+        model_params (dict): The config "models" section
+        trainset_bytes (bytes): Pickled Surprise trainset
+
+    Returns:
+        bytes: The fitted model, pickled
+    """
+    trainset = pickle.loads(trainset_bytes)
+    logger.info(f"Training {model_type} model...")
+    model = _make_model(model_type, model_params)
+
+    # Redirect stdout to suppress similarity matrix computation messages
+    if model_type in ["user_knn", "item_knn"]:
+        # Save original stdout
+        original_stdout = sys.stdout
+        # Redirect stdout to a string buffer
+        sys.stdout = StringIO()
+
+        try:
+            # Fit the model - output will be captured
+            model.fit(trainset)
+        finally:
+            # Restore original stdout
+            sys.stdout = original_stdout
+    else:
+        # For other models, no need to redirect
+        model.fit(trainset)
+
+    return pickle.dumps(model)
+
 class Recommender:
     """
     Restaurant recommendation system using collaborative filtering.
@@ -88,21 +157,29 @@ class Recommender:
         Returns:
             A Surprise model instance
         """
-        try:
-            params = self.model_params.get(model_type, {})
-            if model_type == 'svd':
-                return SVD(**params)
-            if model_type == 'nmf':
-                return NMF(**params)
-            if model_type == 'svdpp':
-                return SVDpp(**params)
-            if model_type in ['user_knn', 'item_knn']:
-                return KNNBasic(sim_options=params.get("sim_options", {}))
-
-            raise ValueError(f"Unknown model type: {model_type}")
-        except Exception as error:
-            logger.error("Failed to build model: %s", error)
-            raise
+        return _make_model(model_type, self.model_params)
+
+    def _build_trainset(self):
+        """
+        Builds the Surprise trainset shared by every model.
+
+        The raw (user, item, rating, timestamp) tuples are zipped column-wise rather than
+        through Dataset.load_from_df, which walks the DataFrame row by row.
+
+        Returns:
+            surprise.Trainset: Full trainset keyed by the raw customer and vendor ids
+        """
+        reader = Reader(rating_scale=(
+            self.data_frame['rating'].min(),
+            self.data_frame['rating'].max()
+        ))
+        raw_ratings = list(zip(
+            self.data_frame['customer_id'].tolist(),
+            self.data_frame['vendor_id'].tolist(),
+            self.data_frame['rating'].astype(float).tolist(),
+            repeat(None)
+        ))
+        return Dataset(reader).construct_trainset(raw_ratings)
 
     def upload_models_to_s3(self):
         """
@@ -135,59 +212,39 @@ class Recommender:
             bucket_name = self.aws_config['bucket_name']
             prefix = self.aws_config['prefix']
 
-            reader = Reader(rating_scale=(
-                self.data_frame['rating'].min(),
-                self.data_frame['rating'].max()
-            ))
-            data = Dataset.load_from_df(
-                self.data_frame[['customer_id', 'vendor_id', 'rating']],
-                reader
-            )
-            trainset = data.build_full_trainset()
-            
-            # Import needed for stdout redirection
-            import sys
-            from io import StringIO
+            trainset = self._build_trainset()
             
+            # The models are independent and CPU-bound, so train them in separate processes
+            trainset_bytes = pickle.dumps(trainset)
+
             upload_status = {}
-            for model_type in ["svd", "nmf", "svdpp", "item_knn"]:
-                logger.info(f"Training {model_type} model...")
-                model = self._build_model(model_type)
-                
-                # Redirect stdout to suppress similarity matrix computation messages
-                if model_type in ["user_knn", "item_knn"]:
-                    # Save original stdout
-                    original_stdout = sys.stdout
-                    # Redirect stdout to a string buffer
-                    sys.stdout = StringIO()
-                    
+            with ProcessPoolExecutor(max_workers=len(MODEL_TYPES)) as executor:
+                futures = {
+                    executor.submit(_train_and_pickle, model_type, self.model_params, trainset_bytes): model_type
+                    for model_type in MODEL_TYPES
+                }
+                # Upload each model as soon as its training finishes
+                for future in as_completed(futures):
+                    model_type = futures[future]
+                    model_bytes = future.result()
+
+                    with tempfile.NamedTemporaryFile(delete=False) as tmp:
+                        tmp.write(model_bytes)
+                        tmp_name = tmp.name
+
                     try:
-                        # Fit the model - output will be captured
-                        model.fit(trainset)
+                        logger.info(f"Uploading {model_type} model to S3...")
+                        s3_key = f"{prefix}{model_type}_model.pkl"
+                        s3_client.upload_file(tmp_name, bucket_name, s3_key)
+                        upload_status[model_type] = True
+                        logger.info(f"Successfully uploaded {model_type} model to S3")
+                    except Exception as upload_error:
+                        logger.error(f"Failed to upload {model_type} model: {upload_error}")
+                        upload_status[model_type] = False
                     finally:
-                        # Restore original stdout
-                        sys.stdout = original_stdout
-                else:
-                    # For other models, no need to redirect
-                    model.fit(trainset)
-                
-                with tempfile.NamedTemporaryFile(delete=False) as tmp:
-                    pickle.dump(model, tmp)
-                    tmp_name = tmp.name
-                
-                try:
-                    logger.info(f"Uploading {model_type} model to S3...")
-                    s3_key = f"{prefix}{model_type}_model.pkl"
-                    s3_client.upload_file(tmp_name, bucket_name, s3_key)
-                    upload_status[model_type] = True
-                    logger.info(f"Successfully uploaded {model_type} model to S3")
-                except Exception as upload_error:
-                    logger.error(f"Failed to upload {model_type} model: {upload_error}")
-                    upload_status[model_type] = False
-                finally:
-                    if os.path.exists(tmp_name):
-                        os.remove(tmp_name)
-            
+                        if os.path.exists(tmp_name):
+                            os.remove(tmp_name)
+
             return upload_status
         
         except Exception as error:
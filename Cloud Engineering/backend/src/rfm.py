@@ -10,7 +10,6 @@ import numpy as np
 import os
 from sqlalchemy import create_engine # type: ignore
 from sqlalchemy.exc import SQLAlchemyError # type: ignore
-from sklearn.preprocessing import StandardScaler
 from sklearn.cluster import KMeans
 
 log_dir = "log"
@@ -36,6 +35,55 @@ if not logger.handlers:
 
 logger.info("RFM module initialized")
 
+def _avg_monthly_orders_per_user(segment, month, customer, has_order, n_segments):
+    """
+    Per segment, the mean over its months of orders / distinct customers in that month.
+
+    Inputs are integer codes aligned by order; rows with a negative code are skipped, like NaN
+    keys in a groupby. Segments without any month come back as NaN. Instead of hashing groups,
+    (segment, month, customer) is packed into one int64 so a single sort yields the distinct
+    customers of every segment-month.
+    """
+    keep = (segment >= 0) & (month >= 0) & (customer >= 0)
+    segment, month, customer, has_order = segment[keep], month[keep], customer[keep], has_order[keep]
+    n_months = int(month.max()) + 1 if len(month) else 0
+    n_customers = int(customer.max()) + 1 if len(customer) else 0
+    n_groups = n_segments * n_months
+
+    group = segment.astype(np.int64) * n_months + month
+    rows = np.bincount(group, minlength=n_groups)
+    orders = np.bincount(group, weights=has_order, minlength=n_groups)
+    pairs = np.unique(group * n_customers + customer)
+    users = np.bincount(pairs // max(n_customers, 1), minlength=n_groups)
+
+    present = rows > 0
+    ratio = np.divide(orders, users, out=np.zeros(n_groups), where=present)
+    with np.errstate(invalid='ignore'):
+        return (ratio.reshape(n_segments, n_months).sum(axis=1)
+                / present.reshape(n_segments, n_months).sum(axis=1))
+
+def _fit_rfm_clusters(features, values, n_clusters, random_state):
+    """
+    Cluster the RFM features and total `values` per cluster.
+
+    `features` is a float64 C-contiguous matrix that is standardized in place before fitting,
+    as StandardScaler would; constant columns keep a scale of 1. Returns the labels, the customer count per cluster and
+    a (n_clusters, n_values) array of per-cluster sums, all column sums taken with one bincount.
+    """
+    features -= features.mean(axis=0)
+    std = features.std(axis=0)
+    std[std == 0] = 1.0
+    features /= std
+    # Full KMeans with the configured seed, so cluster ids line up with the cluster_mapping
+    kmeans = KMeans(n_clusters=n_clusters, random_state=random_state)
+    labels = kmeans.fit_predict(features)
+
+    n_values = values.shape[1]
+    counts = np.bincount(labels, minlength=n_clusters)
+    cells = (labels.astype(np.int64)[:, None] * n_values + np.arange(n_values)).ravel()
+    sums = np.bincount(cells, weights=values.ravel(), minlength=n_clusters * n_values)
+    return labels, counts, sums.reshape(n_clusters, n_values)
+
 class RFM:
     def __init__(self, df=None, config_path=None):
         """Initializes the RFM system by loading configuration and dataset."""
@@ -45,6 +93,11 @@ class RFM:
             self.rfm_config = config["rfm"]
             self.snapshot_date = pd.to_datetime(self.rfm_config["snapshot_date"]).date()
             self.cluster_mapping = self.rfm_config["cluster_mapping"]
+            # Segment name per cluster id, so labels are renamed with one array lookup
+            self._cluster_names = np.array(
+                [self.cluster_mapping.get(i, np.nan) for i in range(self.rfm_config["n_clusters"])],
+                dtype=object
+            )
             if df is not None:
                 self.df = df.copy()
                 logger.info(f"Loaded data, shape: {self.df.shape}")
@@ -56,18 +109,27 @@ class RFM:
         """Select relevant columns and clean data."""
         try:
             self.df = self.df[["customer_id", "created_at", "akeed_order_id", "grand_total"]]
-            self.df['order_date'] = pd.to_datetime(self.df['created_at']).dt.date
-            rfm = self.df.groupby('customer_id').agg({
-                    'order_date': lambda x: (self.snapshot_date - x.max()).days,
-                    'akeed_order_id': 'count',
-                    'grand_total': 'sum'
-                })
-            rfm.rename(columns={
-                    'order_date': 'Recency',
-                    'akeed_order_id': 'Frequency',
-                    'grand_total': 'Monetary'
-                }, inplace=True)
-            self.rfm_df = rfm.reset_index()
+            # Narrow numeric columns before grouping; string customer ids are left as they are
+            int32 = np.iinfo(np.int32)
+            for col in ["customer_id", "akeed_order_id", "grand_total"]:
+                values = self.df[col]
+                if pd.api.types.is_integer_dtype(values) and values.between(int32.min, int32.max).all():
+                    self.df[col] = values.astype('int32')
+                elif pd.api.types.is_float_dtype(values):
+                    self.df[col] = values.astype('float32')
+            # ISO timestamps take the fast parser; repeated strings are parsed once
+            self.df['order_date'] = pd.to_datetime(
+                self.df['created_at'], format='ISO8601', cache=True
+            ).dt.normalize()
+            # Built-in reductions only; Recency is derived from the last order date afterwards
+            rfm = self.df.groupby('customer_id', as_index=False).agg(
+                    last_order=('order_date', 'max'),
+                    Frequency=('akeed_order_id', 'count'),
+                    Monetary=('grand_total', 'sum')
+                )
+            recency = (pd.Timestamp(self.snapshot_date) - rfm.pop('last_order')).dt.days
+            rfm.insert(1, 'Recency', recency.astype('int32'))
+            self.rfm_df = rfm
         except Exception as error:
             logger.error("Error in preprocessing data: %s", error)
             raise
@@ -77,21 +139,44 @@ class RFM:
         """Train KMeans clustering on RFM features."""
         try:
             logger.info("Training RFM clustering model")
-            rfm = self.rfm_df.copy()
+            rfm = self.rfm_df
 
+            # Floor and log in place on one copy, so no intermediate array is allocated
             epsilon = 1e-10
-            rfm['Log_Monetary'] = np.log(np.maximum(rfm['Monetary'], epsilon))
+            log_monetary = rfm['Monetary'].to_numpy(dtype=np.float64, copy=True)
+            np.maximum(log_monetary, epsilon, out=log_monetary)
+            np.log(log_monetary, out=log_monetary)
             
-            features = rfm[['Recency', 'Frequency', 'Log_Monetary']]
-            scaler = StandardScaler()
-            rfm_scaled = scaler.fit_transform(features)
-            kmeans = KMeans(
-                n_clusters=self.rfm_config["n_clusters"],
-                random_state=self.rfm_config["random_state"]
+            # Features stay float64: float32 distances flip labels near cluster borders, which
+            # would no longer line up with the hand-assigned cluster_mapping
+            stats_columns = ['Recency', 'Frequency', 'Monetary']
+            labels, counts, sums = _fit_rfm_clusters(
+                np.column_stack([
+                    rfm['Recency'].to_numpy(dtype=np.float64),
+                    rfm['Frequency'].to_numpy(dtype=np.float64),
+                    log_monetary
+                ]),
+                rfm[stats_columns].to_numpy(dtype=np.float64),
+                self.rfm_config["n_clusters"],
+                self.rfm_config["random_state"]
             )
-            rfm['K-Means'] = kmeans.fit_predict(rfm_scaled)
-            rfm['Segment'] = rfm['K-Means'].map(self.cluster_mapping)
-            self.rfm_labeled = rfm.reset_index()
+            # The only copy of the customer table made here; rfm_df itself is left unchanged
+            self.rfm_labeled = rfm.assign(**{
+                'Log_Monetary': log_monetary,
+                'K-Means': labels,
+                'Segment': self._cluster_names[labels]
+            })
+
+            # Empty clusters are dropped, as a groupby would
+            present = counts > 0
+            cluster_stats = pd.DataFrame({
+                'K-Means': np.flatnonzero(present),
+                **{col: sums[present, i] / counts[present] for i, col in enumerate(stats_columns)},
+                'Count': counts[present]
+            })
+            cluster_stats['Segment'] = self._cluster_names[cluster_stats['K-Means'].to_numpy()]
+            cluster_stats['avg_order_value'] = sums[present, 2] / sums[present, 1]
+            self.cluster_stats = cluster_stats
             logger.info("Model training complete")
         except Exception as e:
             logger.error("Error training model: %s", e)
@@ -101,47 +186,40 @@ class RFM:
         """Calculate CLV per segment using average monthly orders and average order value."""
         try:
             logger.info("Calculating Customer Lifetime Value (CLV_30)")
-            # Merge original orders with segment labels
-            df = self.df.copy()
-            df = pd.merge(df, self.rfm_labeled[['customer_id', 'Segment']], on='customer_id', how='left')
-            df['order_date'] = pd.to_datetime(df['order_date'], errors='coerce')
-            df['year_month'] = df['order_date'].dt.to_period('M')
-            # Step 1: Monthly avg orders per user per segment
-            monthly_orders = df.groupby(['Segment', 'year_month'])['akeed_order_id'].count().reset_index()
-            monthly_users = df.groupby(['Segment', 'year_month'])['customer_id'].nunique().reset_index()
-            monthly_orders = monthly_orders.merge(monthly_users, on=['Segment', 'year_month'], how='left')
-            monthly_orders['Avg_Orders_Per_User_Per_Month'] = (
-                monthly_orders['akeed_order_id'] / monthly_orders['customer_id']
+            # Step 1: Monthly avg orders per user per segment. Each order's position in rfm_labeled
+            # is both its customer code and the lookup for its segment, so nothing is merged
+            customer = pd.Index(self.rfm_labeled['customer_id']).get_indexer(self.df['customer_id'])
+            # Segment codes come from factorizing the k cluster names, not the per-customer strings
+            name_codes, segments = pd.factorize(self._cluster_names, sort=True)
+            segment_codes = name_codes[self.rfm_labeled['K-Means'].to_numpy()]
+            segment = np.where(customer >= 0, segment_codes[customer], -1)
+            # order_date is already parsed and normalized in preprocess
+            order_date = self.df['order_date']
+            has_date = order_date.notna().to_numpy()
+            month = order_date.to_numpy().astype('datetime64[M]').astype(np.int64)
+            month = np.where(has_date, month - (month[has_date].min() if has_date.any() else 0), -1)
+            avg_orders = _avg_monthly_orders_per_user(
+                segment, month, customer, self.df['akeed_order_id'].notna().to_numpy(), len(segments)
             )
-            avg_monthly_orders_per_segment = monthly_orders.groupby('Segment')[
-                'Avg_Orders_Per_User_Per_Month'
-            ].mean().reset_index()
-            avg_monthly_orders_per_segment.columns = ['Segment', 'Avg_Orders_Per_Month_Per_User']
-            # Step 2: Calculate average order value from RFM
-            rfm = self.rfm_labeled.copy()
-            cluster_stats = rfm.groupby('K-Means').agg({
-                'Recency': 'mean',
-                'Frequency': 'mean',
-                'Monetary': 'mean',
-                'K-Means': 'count'
-            }).rename(columns={'K-Means': 'Count'}).reset_index()
-            cluster_stats['Segment'] = cluster_stats['K-Means'].map(self.cluster_mapping)
-            cluster_stats['avg_order_value'] = cluster_stats['Monetary'] / cluster_stats['Frequency']
+            present = ~np.isnan(avg_orders)
+            avg_monthly_orders_per_segment = pd.DataFrame({
+                'Segment': segments[present],
+                'Avg_Orders_Per_Month_Per_User': avg_orders[present]
+            })
+            # Step 2: Average order value per cluster comes from the stats computed at training time
             # Step 3: Combine
             clv_df = pd.merge(
                 avg_monthly_orders_per_segment,
-                cluster_stats[['Segment', 'avg_order_value']],
+                self.cluster_stats[['Segment', 'avg_order_value']],
                 how='left',
                 on='Segment'
             )
             clv_df['CLV_30'] = clv_df['Avg_Orders_Per_Month_Per_User'] * clv_df['avg_order_value']
             self.clv_df = clv_df
-            self.rfm_labeled = pd.merge(
-                self.rfm_labeled[['customer_id', 'Segment']],
-                clv_df[['Segment', 'CLV_30']],
-                on='Segment',
-                how='left'
-            )
+            # One CLV per segment, so a dict lookup replaces the join
+            clv_map = dict(zip(clv_df['Segment'], clv_df['CLV_30']))
+            self.rfm_labeled['CLV_30'] = self.rfm_labeled['Segment'].map(clv_map)
+            self.rfm_labeled = self.rfm_labeled[['customer_id', 'Segment', 'CLV_30']]
         except Exception as e:
             logger.error("Error during CLV_30 calculation: %s", e)
             raise
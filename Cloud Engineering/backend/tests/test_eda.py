@@ -66,5 +66,32 @@ class TestEDA(unittest.TestCase):
         # Should still create at least 1 plot (correlation heatmap might be empty though)
         self.assertGreaterEqual(self.mock_s3_client.upload_fileobj.call_count, 1)
 
+    @patch('src.eda.sns.heatmap')
+    @patch('matplotlib.pyplot.savefig')
+    @patch('boto3.Session')
+    def test_perform_eda_correlation_with_sparse_columns(self, mock_boto3_session, mock_savefig, mock_heatmap):
+        # Configure the mock
+        mock_boto3_session.return_value = self.mock_boto3_session
+
+        # One all-null column and one mostly-null column, as dob and ratings often are
+        df_sparse = self.test_df.assign(
+            dob=np.nan,
+            vendor_rating=[4.0, np.nan, np.nan, 5.0, np.nan]
+        )
+
+        perform_eda(
+            df=df_sparse,
+            bucket_name='test-bucket',
+            s3_prefix='test/',
+            aws_region='us-east-1'
+        )
+
+        # The all-null column is dropped, the other pairs match DataFrame.corr
+        corr = mock_heatmap.call_args_list[0].args[0]
+        expected = df_sparse.drop(columns='dob').corr()
+        self.assertNotIn('dob', corr.columns)
+        self.assertFalse(np.isnan(corr.loc['grand_total', 'item_count']))
+        np.testing.assert_allclose(corr.to_numpy(), expected.to_numpy(), rtol=1e-5)
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,11 +1,12 @@
 import unittest
 import pandas as pd
 import os
+import pickle
 import yaml
 from unittest.mock import patch, MagicMock, mock_open
 import sys
 sys.path.append('../')
-from src.recommender import Recommender
+from src.recommender import Recommender, _train_and_pickle
 
 class TestRecommender(unittest.TestCase):
     def setUp(self):
@@ -53,7 +54,28 @@ class TestRecommender(unittest.TestCase):
         # Test with invalid model type
         with self.assertRaises(ValueError):
             recommender._build_model('invalid_model')
-            
+
+    def test_build_trainset(self):
+        # Test trainset construction keeps the raw ids
+        recommender = Recommender(self.test_config, self.test_df)
+        trainset = recommender._build_trainset()
+
+        self.assertEqual(trainset.n_ratings, 4)
+        self.assertEqual(trainset.n_users, 3)
+        self.assertEqual(trainset.n_items, 3)
+        self.assertEqual(trainset.to_raw_uid(trainset.to_inner_uid(1)), 1)
+        self.assertEqual(trainset.to_raw_iid(trainset.to_inner_iid(103)), 103)
+
+    def test_train_and_pickle(self):
+        # Test a worker returns a fitted, picklable model
+        recommender = Recommender(self.test_config, self.test_df)
+        trainset_bytes = pickle.dumps(recommender._build_trainset())
+
+        for model_type in ['svd', 'item_knn']:
+            model = pickle.loads(_train_and_pickle(model_type, self.test_config['models'], trainset_bytes))
+            self.assertEqual(model.trainset.n_ratings, 4)
+            self.assertIsNotNone(model.predict(1, 103).est)
+
     @patch('boto3.client')
     @patch('tempfile.NamedTemporaryFile')
     @patch('os.remove')
@@ -78,6 +100,36 @@ class TestRecommender(unittest.TestCase):
         with patch.object(recommender, 'aws_config', {'upload': False}):
             result = recommender.upload_models_to_s3()
             self.assertEqual(result, {"upload_enabled": False})
+
+    @patch('boto3.client')
+    def test_upload_models_to_s3_trains_in_pool(self, mock_boto3_client):
+        # Test every model is trained in the pool and uploaded once, and a failed upload is
+        # reported without stopping the others
+        uploaded = {}
+
+        def upload_file(filename, bucket, key):
+            with open(filename, 'rb') as model_file:
+                uploaded[key] = (filename, type(pickle.load(model_file)).__name__)
+            if key == "test/nmf_model.pkl":
+                raise Exception("Access Denied")
+
+        mock_s3 = MagicMock()
+        mock_s3.upload_file.side_effect = upload_file
+        mock_boto3_client.return_value = mock_s3
+        config = dict(self.test_config, aws_rs=dict(self.test_config["aws_rs"], upload=True))
+
+        result = Recommender(config, self.test_df).upload_models_to_s3()
+
+        self.assertEqual(result, {"svd": True, "nmf": False, "svdpp": True, "item_knn": True})
+        self.assertEqual(mock_s3.upload_file.call_count, 4)
+        self.assertEqual({key: name for key, (_, name) in uploaded.items()}, {
+            "test/svd_model.pkl": "SVD",
+            "test/nmf_model.pkl": "NMF",
+            "test/svdpp_model.pkl": "SVDpp",
+            "test/item_knn_model.pkl": "KNNBasic"
+        })
+        for filename, _ in uploaded.values():
+            self.assertFalse(os.path.exists(filename))
         
 if __name__ == '__main__':
     unittest.main()
@@ -6,7 +6,10 @@ import yaml
 from unittest.mock import patch, MagicMock, mock_open
 import sys
 sys.path.append('../')
-from src.rfm import RFM
+from src.rfm import RFM, _fit_rfm_clusters, _avg_monthly_orders_per_user
+import numpy as np
+from sklearn.cluster import KMeans
+from sklearn.preprocessing import StandardScaler
 
 class TestRFM(unittest.TestCase):
     def setUp(self):
@@ -86,6 +89,79 @@ class TestRFM(unittest.TestCase):
                 self.assertIn('K-Means', rfm.rfm_labeled.columns)
                 self.assertIn('Segment', rfm.rfm_labeled.columns)
     
+    def test_segment_names(self):
+        # Test each fixture group gets the one segment name that the original StandardScaler and
+        # seeded KMeans pipeline, which the cluster_mapping was assigned from, gives it
+        config = {"rfm": {
+            "snapshot_date": "2023-12-31", "n_clusters": 4, "random_state": 123,
+            "cluster_mapping": {0: "regular_user", 1: "churn_user", 2: "super_user", 3: "lost_user"}
+        }}
+        rng = np.random.default_rng(7)
+        groups = [(5, 12, 80.0), (40, 4, 40.0), (150, 2, 25.0), (300, 1, 10.0)]
+        rows = []
+        for g, (days, orders, total) in enumerate(groups):
+            for c in range(25):
+                for _ in range(max(1, orders + int(rng.integers(-1, 2)))):
+                    day = days + int(rng.integers(0, 20))
+                    rows.append((f"{g}-{c}", str(date(2023, 12, 31) - timedelta(days=day)),
+                                 len(rows), total * rng.uniform(0.7, 1.3)))
+        orders = pd.DataFrame(rows, columns=['customer_id', 'created_at', 'akeed_order_id', 'grand_total'])
+
+        with patch('builtins.open', mock_open()):
+            with patch('yaml.safe_load', return_value=config):
+                rfm = RFM(df=orders, config_path="mock_config.yaml")
+                rfm.preprocess()
+                rfm._train_model()
+
+        features = rfm.rfm_df[['Recency', 'Frequency']].assign(
+            Log_Monetary=np.log(np.maximum(rfm.rfm_df['Monetary'], 1e-10)))
+        expected = KMeans(n_clusters=4, random_state=123).fit_predict(
+            StandardScaler().fit_transform(features))
+        self.assertEqual(rfm.rfm_labeled['Segment'].tolist(),
+                         pd.Series(expected).map(config["rfm"]["cluster_mapping"]).tolist())
+        names = ['churn_user', 'super_user', 'regular_user', 'lost_user']
+        self.assertEqual(rfm.rfm_labeled['Segment'].tolist(),
+                         [names[int(c.split('-')[0])] for c in rfm.rfm_labeled['customer_id']])
+
+    def test_fit_rfm_clusters(self):
+        # Test per-cluster counts and sums match the labels
+        features = np.array([[1, 1, 1], [1, 1, 1.1], [9, 9, 9], [9, 9, 9.1]], dtype=np.float64)
+        values = np.array([[1, 2, 3], [1, 2, 5], [10, 20, 30], [10, 20, 50]], dtype=np.float64)
+        labels, counts, sums = _fit_rfm_clusters(features, values, 2, 42)
+
+        self.assertEqual(labels[0], labels[1])
+        self.assertNotEqual(labels[0], labels[2])
+        self.assertEqual(counts.tolist(), [2, 2])
+        np.testing.assert_allclose(sums[labels[0]], [2, 4, 8])
+        np.testing.assert_allclose(sums[labels[2]], [20, 40, 80])
+
+    def test_avg_monthly_orders_per_user(self):
+        # Test the kernel against the groupby it replaced, with a missing date, missing order ids
+        # and a customer whose cluster has no segment name
+        orders = pd.DataFrame({
+            'customer_id': ['a', 'a', 'b', 'b', 'c', 'c', 'd', 'e'],
+            'Segment': ['x', 'x', 'x', 'x', 'y', 'y', np.nan, 'y'],
+            'order_date': pd.to_datetime(['2023-01-05', '2023-01-20', '2023-01-07', '2023-02-03',
+                                          '2023-02-10', None, '2023-01-01', '2023-03-15']),
+            'akeed_order_id': [1, 2, 3, np.nan, 5, 6, 7, np.nan]
+        })
+        monthly = (orders.assign(year_month=orders['order_date'].dt.to_period('M'))
+                   .groupby(['Segment', 'year_month'])
+                   .agg(orders=('akeed_order_id', 'count'), users=('customer_id', 'nunique')))
+        expected = (monthly['orders'] / monthly['users']).groupby(level='Segment').mean()
+
+        segment, segments = pd.factorize(orders['Segment'], sort=True)
+        customer, _ = pd.factorize(orders['customer_id'])
+        has_date = orders['order_date'].notna().to_numpy()
+        month = orders['order_date'].to_numpy().astype('datetime64[M]').astype(np.int64)
+        month = np.where(has_date, month - month[has_date].min(), -1)
+        result = _avg_monthly_orders_per_user(
+            segment, month, customer, orders['akeed_order_id'].notna().to_numpy(), len(segments)
+        )
+
+        self.assertEqual(list(segments), list(expected.index))
+        np.testing.assert_allclose(result, expected.to_numpy())
+
     def test_run(self):
         # Test the full pipeline
         with patch('builtins.open', mock_open()):
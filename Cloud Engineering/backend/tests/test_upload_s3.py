@@ -3,7 +3,7 @@ import pandas as pd
 from unittest.mock import patch, MagicMock, ANY
 import sys
 sys.path.append('../')
-from src.upload_s3 import upload_clustering_to_s3
+from src.upload_s3 import upload_clustering_to_s3, _get_s3_client
 
 class TestUploadS3(unittest.TestCase):
     def setUp(self):
@@ -16,14 +16,17 @@ class TestUploadS3(unittest.TestCase):
         
         # Mock boto3 client
         self.mock_s3_client = MagicMock()
+
+        # Clients are cached per region, so each test starts from an empty cache
+        _get_s3_client.cache_clear()
         
     @patch('boto3.client')
     @patch('os.environ.get')  # Mock environment variable access
     def test_upload_clustering_to_s3(self, mock_environ_get, mock_boto3_client):
         # Configure the mocks
         mock_boto3_client.return_value = self.mock_s3_client
-        # Make os.environ.get return None for AWS credentials
-        mock_environ_get.return_value = None
+        # Make os.environ.get return None for AWS credentials (other lookups keep their default)
+        mock_environ_get.side_effect = lambda key, default=None: None if key.startswith('AWS_') else default
         
         # Test with default filename
         s3_uri = upload_clustering_to_s3(
@@ -41,12 +44,17 @@ class TestUploadS3(unittest.TestCase):
             aws_secret_access_key=ANY
         )
         
-        # Verify put_object was called
-        self.mock_s3_client.put_object.assert_called_once()
+        # Verify upload_fileobj was called
+        self.mock_s3_client.upload_fileobj.assert_called_once()
         
-        # Verify S3 URI format
+        # Verify S3 URI format (Parquet by default)
         self.assertTrue(s3_uri.startswith('s3://test-bucket/test/clustering_'))
-        self.assertTrue(s3_uri.endswith('.csv'))
+        self.assertTrue(s3_uri.endswith('.parquet'))
+
+        # Verify the uploaded bytes read back as the same DataFrame
+        buffer = self.mock_s3_client.upload_fileobj.call_args[0][0]
+        buffer.seek(0)
+        pd.testing.assert_frame_equal(pd.read_parquet(buffer), self.test_df)
         
     @patch('boto3.client')
     def test_upload_with_custom_filename(self, mock_boto3_client):
@@ -66,16 +74,35 @@ class TestUploadS3(unittest.TestCase):
         expected_s3_uri = 's3://test-bucket/test/custom_file.csv'
         self.assertEqual(s3_uri, expected_s3_uri)
         
-        # Verify put_object was called with correct key
-        call_kwargs = self.mock_s3_client.put_object.call_args[1]
-        self.assertEqual(call_kwargs['Bucket'], 'test-bucket')
-        self.assertEqual(call_kwargs['Key'], 'test/custom_file.csv')
+        # Verify upload_fileobj was called with correct key and CSV content
+        buffer, bucket, key = self.mock_s3_client.upload_fileobj.call_args[0]
+        self.assertEqual(bucket, 'test-bucket')
+        self.assertEqual(key, 'test/custom_file.csv')
+        buffer.seek(0)
+        pd.testing.assert_frame_equal(pd.read_csv(buffer), self.test_df)
     
+    @patch('boto3.client')
+    def test_client_reused_across_uploads(self, mock_boto3_client):
+        # The S3 client is built once per region and reused
+        mock_boto3_client.return_value = self.mock_s3_client
+
+        for name in ['first.csv', 'second.csv']:
+            upload_clustering_to_s3(
+                df=self.test_df,
+                bucket_name='test-bucket',
+                s3_prefix='test/',
+                aws_region='us-east-1',
+                filename=name
+            )
+
+        mock_boto3_client.assert_called_once()
+        self.assertEqual(self.mock_s3_client.upload_fileobj.call_count, 2)
+
     @patch('boto3.client')
     def test_upload_error_handling(self, mock_boto3_client):
         # Configure the mock to raise an exception
         mock_boto3_client.return_value = self.mock_s3_client
-        self.mock_s3_client.put_object.side_effect = Exception("Upload failed")
+        self.mock_s3_client.upload_fileobj.side_effect = Exception("Upload failed")
         
         # Test error handling
         with self.assertRaises(Exception):
@@ -0,0 +1,75 @@
+import unittest
+import os
+import sys
+import numpy as np
+import pandas as pd
+from unittest.mock import patch, MagicMock
+from surprise import Dataset, Reader, SVD, SVDpp, NMF, KNNBasic
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import webapp
+
+
+class TestEstimateScores(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        rng = np.random.default_rng(0)
+        ratings = pd.DataFrame({
+            'customer_id': [f"C{u}" for u in rng.integers(0, 30, 400)],
+            'vendor_id': rng.integers(100, 140, 400),
+            'rating': rng.integers(1, 6, 400)
+        }).drop_duplicates(['customer_id', 'vendor_id'])
+        data = Dataset.load_from_df(ratings, Reader(rating_scale=(1, 5)))
+        cls.trainset = data.build_full_trainset()
+        cls.users = sorted(ratings['customer_id'].unique())[:10] + ["UNKNOWN"]
+        # Every vendor the model knows, plus one it was never trained on
+        cls.vendors = np.append(np.sort(ratings['vendor_id'].unique()), 999)
+
+    def assert_matches_predict(self, model):
+        item_index = pd.Index([self.trainset.to_raw_iid(i) for i in range(self.trainset.n_items)])
+        items = item_index.get_indexer(self.vendors).astype(np.int32)
+        for uid in self.users:
+            expected = [model.predict(uid, iid).est for iid in self.vendors]
+            scores = webapp._estimate_scores(model, uid, self.vendors, items)
+            np.testing.assert_allclose(scores, expected, rtol=0, atol=1e-9, err_msg=str(uid))
+
+    def test_svd(self):
+        # Test biased SVD scores match predict, including the unknown user and vendor
+        self.assert_matches_predict(SVD(n_factors=5, n_epochs=5, random_state=0).fit(self.trainset))
+
+    def test_svd_unbiased(self):
+        # Test unbiased SVD falls back to the mean where predict cannot score
+        self.assert_matches_predict(SVD(n_factors=5, n_epochs=5, biased=False, random_state=0).fit(self.trainset))
+
+    def test_nmf(self):
+        self.assert_matches_predict(NMF(n_factors=5, n_epochs=5, random_state=0).fit(self.trainset))
+        self.assert_matches_predict(NMF(n_factors=5, n_epochs=5, biased=True, random_state=0).fit(self.trainset))
+
+    def test_svdpp(self):
+        # Test the implicit feedback term of SVD++ is added for known users
+        self.assert_matches_predict(SVDpp(n_factors=5, n_epochs=3, random_state=0).fit(self.trainset))
+
+    def test_knn(self):
+        # Test models without factors go through estimate and its impossible-prediction fallback
+        knn = KNNBasic(sim_options={'name': 'cosine', 'user_based': False}, verbose=False)
+        self.assert_matches_predict(knn.fit(self.trainset))
+
+    def test_inner_uid(self):
+        # Test known users map to their inner id and unknown ones to -1
+        self.assertEqual(webapp._inner_uid(self.trainset, self.users[0]), self.trainset.to_inner_uid(self.users[0]))
+        self.assertEqual(webapp._inner_uid(self.trainset, "UNKNOWN"), -1)
+
+
+class TestModelEtag(unittest.TestCase):
+    def test_etag_cached_between_reruns(self):
+        # Test reruns within the TTL reuse the ETag instead of sending another HEAD request
+        client = MagicMock()
+        client.head_object.return_value = {"ETag": '"abc"'}
+        webapp._model_etag.clear()
+        self.addCleanup(webapp._model_etag.clear)
+        with patch.object(webapp, '_s3', return_value=client):
+            self.assertEqual(webapp._model_etag("bucket", "model.pkl"), '"abc"')
+            self.assertEqual(webapp._model_etag("bucket", "model.pkl"), '"abc"')
+        client.head_object.assert_called_once_with(Bucket="bucket", Key="model.pkl")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -10,9 +10,13 @@ import pickle
 import numpy as np
 from typing import Any, Optional
 import streamlit as st
+from surprise import PredictionImpossible
 import yaml
+from scipy.sparse import csr_array
 import pandas as pd
-import io
+import pyarrow as pa
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
 
 # Load .env file
 load_dotenv()
@@ -32,6 +36,10 @@ logging.basicConfig(
 
 logger = logging.getLogger("webapp_interface")
 
+# Columns the app uses from each Parquet artifact; nothing else is read from S3
+RFM_COLUMNS = ["customer_id", "Segment_x", "Segment_y", "CLV_30"]
+ORDER_COLUMNS = ["customer_id", "vendor_id"]
+
 
 @st.cache_resource
 def load_config(path: str = "config/config_webapp.yaml") -> dict:
@@ -50,45 +58,167 @@ def load_config(path: str = "config/config_webapp.yaml") -> dict:
     return config_data
 
 
-@st.cache_data
-def load_rfm_from_s3(bucket: str, key: str):
+@st.cache_resource
+def _s3():
+    """
+    Shared S3 client, created once and reused across reruns.
+
+    Returns:
+        Any: boto3 S3 client
+    """
+    return boto3.client("s3")
+
+
+@st.cache_resource
+def _s3fs(region: str):
+    """
+    Shared pyarrow S3 filesystem, created once per region.
+
+    Args:
+        region (str): AWS region of the bucket.
+
+    Returns:
+        pafs.S3FileSystem: Filesystem used to read Parquet artifacts.
+    """
+    return pafs.S3FileSystem(region=region)
+
+
+def _read_parquet_from_s3(
+    bucket: str, key: str, region: str, columns: list, filters: Optional[list] = None,
+    categories: Optional[list] = None
+) -> pd.DataFrame:
+    """
+    Read selected columns of a Parquet object in S3 into Arrow-backed pandas columns.
+
+    Args:
+        bucket (str): Name of the S3 bucket.
+        key (str): Path to the Parquet file in the S3 bucket.
+        region (str): AWS region of the bucket.
+        columns (list): Columns to read; the others are never downloaded.
+        filters (Optional[list]): Row filters pushed down to the Parquet reader.
+        categories (Optional[list]): Columns read dictionary-encoded, as pandas categoricals.
+
+    Returns:
+        pd.DataFrame: The requested columns.
+    """
+    table = pq.read_table(
+        f"{bucket}/{key}", filesystem=_s3fs(region), columns=columns, filters=filters,
+        read_dictionary=categories
+    )
+    return table.to_pandas(
+        self_destruct=True, split_blocks=True,
+        types_mapper=lambda t: None if pa.types.is_dictionary(t) else pd.ArrowDtype(t)
+    )
+
+
+def load_rfm_from_s3(bucket: str, key: str, region: str):
     """
-    Load RFM clustering results from a CSV file in S3.
+    Load RFM clustering results from a Parquet file in S3.
 
     Args:
         bucket (str): Name of the S3 bucket.
-        key (str): Path to the RFM CSV file in the S3 bucket.
+        key (str): Path to the RFM Parquet file in the S3 bucket.
+        region (str): AWS region of the bucket.
 
     Returns:
         pd.DataFrame: DataFrame containing RFM segmentation and CLV data.
     """
-    s3_client = boto3.client("s3")
-    response = s3_client.get_object(Bucket=bucket, Key=key)
-    content = response["Body"].read()
-    df = pd.read_csv(io.BytesIO(content))
+    df = _read_parquet_from_s3(bucket, key, region, RFM_COLUMNS)
     logger.info("RFM data loaded from S3: s3://%s/%s", bucket, key)
     return df
 
 
-@st.cache_data
-def load_data_recom(bucket: str, key: str) -> pd.DataFrame:
+@st.cache_resource
+def build_rfm_lookup(bucket: str, key: str, region: str) -> dict:
+    """
+    Segments and CLV per customer, built once per dataset.
+
+    Args:
+        bucket (str): Name of the S3 bucket.
+        key (str): Path to the RFM Parquet file in the S3 bucket.
+        region (str): AWS region of the bucket.
+
+    Returns:
+        dict: customer_id -> (customer segment, food segment, CLV_30), first row per customer.
+    """
+    df = load_rfm_from_s3(bucket, key, region).drop_duplicates("customer_id")
+    return dict(zip(df["customer_id"], zip(df["Segment_x"], df["Segment_y"], df["CLV_30"])))
+
+
+def load_data_recom(bucket: str, key: str, region: str) -> pd.DataFrame:
+    """
+    Load order history data from S3 for restaurant vendors only.
+
+    Args:
+        bucket (str): Name of the S3 bucket.
+        key (str): Path to the restaurant-only order Parquet file written by the ETL.
+        region (str): AWS region of the bucket.
+
+    Returns:
+        pd.DataFrame: Customer (categorical) and vendor ids of restaurant orders.
     """
-    Load raw order history data from S3 and filter for restaurant vendors only.
+    return _read_parquet_from_s3(bucket, key, region, ORDER_COLUMNS, categories=["customer_id"])
+
+@st.cache_resource
+def build_indexes(bucket: str, key: str, region: str):
+    """
+    Vendor lookups derived from the order history, built once per dataset.
 
     Args:
         bucket (str): Name of the S3 bucket.
-        key (str): Path to the order history CSV in the S3 bucket.
+        key (str): Path to the restaurant-only order Parquet file written by the ETL.
+        region (str): AWS region of the bucket.
 
     Returns:
-        pd.DataFrame: Filtered DataFrame with only restaurant order.
+        tuple: All vendor ids in order of appearance, the customer ids in order of appearance,
+        and a sparse customer x vendor matrix of order counts in the same orders.
     """
-    s3 = boto3.client("s3")
-    response = s3.get_object(Bucket=bucket, Key=key)
-    content = response["Body"].read()
-    df = pd.read_csv(io.BytesIO(content))
-    return df[df["vendor_category_en"] == "Restaurants"]
+    order_df = load_data_recom(bucket, key, region)
+    vendor_codes, all_vendors = pd.factorize(order_df["vendor_id"].to_numpy())
+    customer_codes, customers = pd.factorize(order_df["customer_id"])
+    known = (customer_codes >= 0) & (vendor_codes >= 0)
+    # Repeated (customer, vendor) orders are summed; a row's indices are the vendors visited
+    visits = csr_array(
+        (np.ones(known.sum(), dtype=np.int32), (customer_codes[known], vendor_codes[known])),
+        shape=(len(customers), len(all_vendors))
+    )
+    return all_vendors, pd.Index(customers), visits
 
 @st.cache_resource
+def _load_model(bucket: str, key: str, etag: str):
+    """
+    Unpickle a model straight from the S3 response stream.
+
+    The ETag is part of the cache key so a replaced pickle is reloaded. Also returns an
+    index of the raw item ids in inner id order, so raw ids translate with one lookup.
+    """
+    response = _s3().get_object(Bucket=bucket, Key=key)
+    model = pickle.load(response["Body"])
+    # Factors are only read for scoring; float32 halves the bytes moved per estimate
+    for factors in ("pu", "qi", "yj"):
+        if hasattr(model, factors):
+            setattr(model, factors, getattr(model, factors).astype(np.float32, copy=False))
+    trainset = model.trainset
+    item_index = pd.Index([trainset.to_raw_iid(i) for i in range(trainset.n_items)])
+    logger.info("Model %s loaded from s3://%s/%s", key, bucket, key)
+    return model, item_index
+
+
+@st.cache_data(ttl=60)
+def _model_etag(bucket: str, key: str) -> str:
+    """
+    ETag of a model pickle, looked up at most once a minute instead of on every rerun.
+
+    Args:
+        bucket (str): Name of the S3 bucket.
+        key (str): Path to the model pickle file in the S3 bucket.
+
+    Returns:
+        str: ETag of the pickle; a replaced model is picked up within the TTL.
+    """
+    return _s3().head_object(Bucket=bucket, Key=key)["ETag"]
+
+
 def load_model_from_s3(bucket: str, key: str):
     """
     Load collaborative filtering model from S3.
@@ -98,13 +228,167 @@ def load_model_from_s3(bucket: str, key: str):
         key (str): Path to the model pickle file in the S3 bucket.
 
     Returns:
-        Any: Load Surprise model
+        tuple: Loaded Surprise model, its raw item ids indexed by inner id, and the ETag of
+        the pickle
     """
-    s3 = boto3.client("s3")
-    response = s3.get_object(Bucket=bucket, Key=key)
-    model = pickle.load(io.BytesIO(response["Body"].read()))
-    logger.info("Model %s loaded from s3://%s/%s", key, bucket, key)
-    return model
+    etag = _model_etag(bucket, key)
+    model, item_index = _load_model(bucket, key, etag)
+    return model, item_index, etag
+
+
+def _inner_uid(trainset: Any, uid: Any) -> int:
+    """
+    Inner id of a raw user id, or -1 when the model was not trained on that user.
+
+    Args:
+        trainset (Any): Trainset of a fitted Surprise model.
+        uid (Any): Raw id of the user.
+
+    Returns:
+        int: Inner user id, -1 for an unknown user.
+    """
+    try:
+        return trainset.to_inner_uid(uid)
+    except ValueError:
+        return -1
+
+
+def _estimate_scores(model: Any, uid: Any, iids: np.ndarray, items: np.ndarray) -> np.ndarray:
+    """
+    Estimated ratings of one user for many items, equal to ``model.predict(uid, iid).est``.
+
+    Matrix factorization models (SVD, NMF, SVD++) are scored with one matrix-vector product
+    over the item factors; other models call ``estimate`` per item, without building the
+    ``Prediction`` objects ``predict`` would.
+
+    Args:
+        model (Any): Fitted Surprise model.
+        uid (Any): Raw id of the user.
+        iids (np.ndarray): Raw ids of the items to score.
+        items (np.ndarray): Inner ids of the same items, -1 where the model does not know one.
+
+    Returns:
+        np.ndarray: Estimates clipped to the rating scale, aligned with ``iids``.
+    """
+    trainset = model.trainset
+    u = _inner_uid(trainset, uid)
+    known = items >= 0
+    scores = np.empty(len(items), dtype=np.float64)
+
+    if not (hasattr(model, "pu") and hasattr(model, "qi")):
+        # Unknown ids are passed the way predict passes them, so estimate rejects them the same way
+        inner_uid = u if u >= 0 else "UKN__" + str(uid)
+        for pos, (iid, i) in enumerate(zip(iids, items.tolist())):
+            try:
+                est = model.estimate(inner_uid, i if i >= 0 else "UKN__" + str(iid))
+                scores[pos] = est[0] if isinstance(est, tuple) else est
+            except PredictionImpossible:
+                scores[pos] = model.default_prediction()
+    elif getattr(model, "biased", True):
+        # Same terms as the Surprise estimate: the mean, then biases of known ids, then the factors
+        base = trainset.global_mean + (model.bu[u] if u >= 0 else 0.0)
+        scores[:] = base
+        scores[known] = base + model.bi[items[known]]
+        if u >= 0:
+            user_vec = model.pu[u]
+            if hasattr(model, "yj"):
+                rated = [j for (j, _) in trainset.ur[u]]
+                user_vec = user_vec + model.yj[rated].sum(axis=0) / np.sqrt(len(rated))
+            scores[known] += model.qi[items[known]] @ user_vec
+    else:
+        # Unbiased models cannot score unknown ids and fall back to the default prediction
+        scores[:] = trainset.global_mean
+        if u >= 0:
+            scores[known] = model.qi[items[known]] @ model.pu[u]
+
+    lower_bound, higher_bound = trainset.rating_scale
+    return np.clip(scores, lower_bound, higher_bound)
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Positions of the k highest scores, best first; ties keep their original order.
+
+    Args:
+        scores (np.ndarray): Scores to rank.
+        k (int): Number of positions to return.
+
+    Returns:
+        np.ndarray: Indices into ``scores``.
+    """
+    if k >= len(scores):
+        return np.argsort(-scores, kind="stable")
+    # Partition to find the k-th best score, then sort only the scores that reach it
+    threshold = np.partition(scores, len(scores) - k)[len(scores) - k]
+    candidates = np.flatnonzero(scores >= threshold)
+    return candidates[np.argsort(-scores[candidates], kind="stable")[:k]]
+
+
+@st.cache_resource
+def _cold_start_scores(
+    model_key: str, model_etag: str, order_key: str,
+    _model: Any, _item_index: pd.Index, _all_vendors: np.ndarray, _uid: Any
+) -> np.ndarray:
+    """
+    Scores of every vendor for customers the model was not trained on.
+
+    Surprise scores an unknown user the same way whoever they are, so one array, computed
+    for any unknown id, serves all of them.
+
+    Args:
+        model_key (str): Path to the model pickle in S3.
+        model_etag (str): ETag of the loaded pickle.
+        order_key (str): Path to the order Parquet file ``_all_vendors`` comes from.
+        _model (Any): Loaded Surprise model.
+        _item_index (pd.Index): Raw item ids of the model indexed by inner id.
+        _all_vendors (np.ndarray): All vendor ids from ``build_indexes``.
+        _uid (Any): A raw user id unknown to the model.
+
+    Returns:
+        np.ndarray: Estimates aligned with ``_all_vendors``.
+    """
+    items = _item_index.get_indexer(_all_vendors).astype(np.int32)
+    return _estimate_scores(_model, _uid, _all_vendors, items)
+
+
+@st.cache_data(ttl=3600)
+def recommend(
+    model_key: str, model_etag: str, order_key: str, customer_id: str, k: int,
+    _model: Any, _item_index: pd.Index, _indexes: tuple
+) -> pd.DataFrame:
+    """
+    Top-k untried vendors for a customer, cached per model version, dataset, customer and k.
+
+    Args:
+        model_key (str): Path to the model pickle in S3.
+        model_etag (str): ETag of the loaded pickle, so a replaced model is not served stale results.
+        order_key (str): Path to the order Parquet file the indexes were built from.
+        customer_id (str): Customer to recommend for.
+        k (int): Number of vendors to return.
+        _model (Any): Loaded Surprise model; identified by the key and ETag, not hashed.
+        _item_index (pd.Index): Raw item ids of the model indexed by inner id.
+        _indexes (tuple): Output of ``build_indexes`` for ``order_key``.
+
+    Returns:
+        pd.DataFrame: Vendor ids and estimated scores, best first.
+    """
+    all_vendors, customers, visits = _indexes
+    # The customer's row of the visit matrix holds the vendor codes to exclude
+    untried = np.ones(len(all_vendors), dtype=bool)
+    code = customers.get_indexer([customer_id])[0]
+    if code >= 0:
+        untried[visits.indices[visits.indptr[code]:visits.indptr[code + 1]]] = False
+    candidates = all_vendors[untried]
+
+    if _inner_uid(_model.trainset, customer_id) >= 0:
+        items = _item_index.get_indexer(candidates).astype(np.int32)
+        scores = _estimate_scores(_model, customer_id, candidates, items)
+    else:
+        scores = _cold_start_scores(
+            model_key, model_etag, order_key, _model, _item_index, all_vendors, customer_id
+        )[untried]
+    top_n = _top_k(scores, k)
+    return pd.DataFrame({"Vendor ID": candidates[top_n], "Estimated Score": scores[top_n]})
 
 
 def run_app():
@@ -118,31 +402,32 @@ def run_app():
 
     config = load_config()
     bucket_name = config.get("bucket_name")
+    region = config.get("region")
     rfm_key = config.get("clustering_key")
     order_key = config.get("recom_data")
 
-    rfm_df = load_rfm_from_s3(bucket_name, rfm_key)
-    order_df = load_data_recom(bucket_name, order_key)
+    rfm_lookup = build_rfm_lookup(bucket_name, rfm_key, region)
+    all_vendors, customers, visits = build_indexes(bucket_name, order_key, region)
 
     st.subheader("Choose Model and Customer")
     col1, col2 = st.columns(2)
 
     model_options = list(config["models"].keys())
     with col1:
-        customer_ids = order_df["customer_id"].unique()
+        customer_ids = list(customers)
         selected_customer = st.selectbox("Customer ID", customer_ids)
 
     with col2:
         model_choice = st.selectbox("Recommendation Model", model_options)
 
     model_key = config["models"][model_choice]["s3_key"]
-    model = load_model_from_s3(bucket_name, model_key)
+    model, item_index, model_etag = load_model_from_s3(bucket_name, model_key)
 
-    row = rfm_df[rfm_df["customer_id"] == selected_customer]
-    if not row.empty:
-        st.markdown(f"**Customer Segment:** {row['Segment_x'].values[0]}")
-        st.markdown(f"**Food Segment:** {row['Segment_y'].values[0]}")
-        st.markdown(f"**Estimated CLV (30 days):** ${row['CLV_30'].values[0]:.2f}")
+    if selected_customer in rfm_lookup:
+        segment, food_segment, clv = rfm_lookup[selected_customer]
+        st.markdown(f"**Customer Segment:** {segment}")
+        st.markdown(f"**Food Segment:** {food_segment}")
+        st.markdown(f"**Estimated CLV (30 days):** ${clv:.2f}")
     else:
         st.warning("Customer not found in RFM data.")
 
@@ -150,22 +435,9 @@ def run_app():
 
     if st.button("Get Recommendations"):
         with st.spinner("Generating recommendations..."):
-            all_vendors = order_df["vendor_id"].unique()
-            customer_vendors = order_df[
-                order_df["customer_id"] == selected_customer
-            ]["vendor_id"].unique()
-            vendor_to_predict = [
-                v for v in all_vendors if v not in customer_vendors
-            ]
-
-            predictions = [
-                model.predict(selected_customer, vendor) for vendor in vendor_to_predict
-            ]
-            top_n = sorted(predictions, key=lambda x: x.est, reverse=True)[:k]
-
-            rec_df = pd.DataFrame(
-                [(pred.iid, pred.est) for pred in top_n],
-                columns=["Vendor ID", "Estimated Score"],
+            rec_df = recommend(
+                model_key, model_etag, order_key, selected_customer, k,
+                model, item_index, (all_vendors, customers, visits)
             )
 
         st.success(f"Top {k} recommendations for customer {selected_customer}:")